@@ -2,13 +2,21 @@
 # AzLure CLI — Automatic or Manual deployment wrapper for Terraform
 import os
 import sys
+import copy
 import json
 import time
 import click
+import shutil
+import functools
 import subprocess
 from pathlib import Path
 import yaml
 
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
 ROOT = Path(__file__).resolve().parents[1]
 TF_DIR = ROOT / "infra" / "terraform"
 EXAMPLES = ROOT / "examples" / "demo-config.yml"
@@ -31,20 +39,32 @@ def sh(cmd, cwd=None, env=None, capture=False):
         return subprocess.check_output(cmd, cwd=cwd, env=env).decode("utf-8")
     subprocess.check_call(cmd, cwd=cwd, env=env)
 
+@functools.lru_cache(maxsize=1)
 def ensure_tools():
     for bin in ["terraform", "az", "python"]:
         if not shutil.which(bin):
             raise click.ClickException(f"{bin} not found on PATH.")
 
+# path -> (st_mtime_ns, parsed config)
+_CFG_CACHE = {}
+
 def load_cfg(path):
-    with open(path, "r") as f:
-        return yaml.safe_load(f)
+    """Parse a YAML config, reusing the previous parse while the file's mtime is unchanged."""
+    path = str(path)
+    mtime = os.stat(path).st_mtime_ns
+    hit = _CFG_CACHE.get(path)
+    if not hit or hit[0] != mtime:
+        with open(path, "r") as f:
+            hit = _CFG_CACHE[path] = (mtime, yaml.load(f, Loader=_Loader))
+    # callers (e.g. manual) mutate the config, so never hand out the cached object
+    return copy.deepcopy(hit[1])
 
 def write_tfvars(cfg, outpath):
     """
     Writes or updates Terraform variables file.
     If file already exists, preserve the user's chosen 'location'
     and any other manually edited keys instead of overwriting.
+    The file is only rewritten when the merged values differ from what is on disk.
     """
     import json
 
@@ -82,12 +102,34 @@ def write_tfvars(cfg, outpath):
         "grant_app_automation_contributor": cfg["features"].get("grant_app_automation_contributor", True),
     })
 
-    with open(outpath, "w") as f:
-        json.dump(tfvars, f, indent=2)
+    # nothing changed: leave the file (and its mtime) alone
+    if tfvars == existing and os.path.exists(outpath):
+        return outpath
+
+    # sorted keys keep the output deterministic; write-then-rename so a crash never leaves half a file
+    tmp = f"{outpath}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(tfvars, f, indent=2, sort_keys=True)
+    os.replace(tmp, outpath)
 
     return outpath
 
 
+def tf_parallelism(override=None):
+    """Terraform -parallelism: explicit override, else 3x CPUs (never below Terraform's default of 10)."""
+    if override is not None:
+        return override
+    return max(10, 3 * (os.cpu_count() or 4))
+
+def tf_plan_apply(tfvars_path, parallelism=None, refresh=True):
+    par = ["-parallelism", str(tf_parallelism(parallelism))]
+    plan = ["terraform", "plan", "-var-file", str(tfvars_path), "-out", "tfplan"] + par
+    if not refresh:
+        plan.append("-refresh=false")
+    sh(plan, cwd=str(TF_DIR))
+    sh(["terraform", "apply"] + par + ["tfplan"], cwd=str(TF_DIR))
+
+
 def print_step(msg, url=None):
     if url:
         click.echo(click.style(f"{msg} → {url}", fg="green"))
@@ -95,13 +137,18 @@ def print_step(msg, url=None):
         click.echo(click.style(msg, fg="green"))
 
 @click.group()
-def cli():
-    click.echo(click.style(BANNER, fg="magenta"))
+@click.pass_context
+def cli(ctx):
+    # banner only for interactive runs of a subcommand (not bare --help/usage or piped output)
+    if ctx.invoked_subcommand and click.get_text_stream("stdout").isatty():
+        click.echo(click.style(BANNER, fg="magenta"))
 
 @cli.command(help="Automatic mode: deploy with opinionated defaults")
 @click.option("--config", "-c", default=str(EXAMPLES), help="YAML config (uses examples/demo-config.yml by default)")
 @click.option("--yes", is_flag=True, help="Skip confirmation")
-def auto(config, yes):
+@click.option("--parallelism", type=click.IntRange(min=1), default=None, help="Terraform -parallelism (default: 3x CPU count, min 10)")
+@click.option("--refresh/--no-refresh", default=True, help="Refresh state during plan (--no-refresh for re-runs without drift)")
+def auto(config, yes, parallelism, refresh):
     cfg = load_cfg(config)
     cfg["mode"] = "auto"
     if not yes:
@@ -112,8 +159,7 @@ def auto(config, yes):
 
     # terraform init/plan/apply
     sh(["terraform", "init"], cwd=str(TF_DIR))
-    sh(["terraform", "plan", "-var-file", str(tfvars_path), "-out", "tfplan"], cwd=str(TF_DIR))
-    sh(["terraform", "apply", "tfplan"], cwd=str(TF_DIR))
+    tf_plan_apply(tfvars_path, parallelism, refresh)
 
     # fetch outputs
     out_json = sh(["terraform", "output", "-json"], cwd=str(TF_DIR), capture=True)
@@ -140,7 +186,9 @@ def auto(config, yes):
 @click.option("--automation", default="Automatic Backup", help="Automation Account name")
 @click.option("--location", default="southeastasia")
 @click.option("--yes", is_flag=True)
-def manual(tenant, public_sa, private_sa, keyvault, automation, location, yes):
+@click.option("--parallelism", type=click.IntRange(min=1), default=None, help="Terraform -parallelism (default: 3x CPU count, min 10)")
+@click.option("--refresh/--no-refresh", default=True, help="Refresh state during plan (--no-refresh for re-runs without drift)")
+def manual(tenant, public_sa, private_sa, keyvault, automation, location, yes, parallelism, refresh):
     cfg = load_cfg(EXAMPLES)
     cfg["mode"] = "manual"
     cfg["tenant_name"] = tenant
@@ -158,8 +206,7 @@ def manual(tenant, public_sa, private_sa, keyvault, automation, location, yes):
     tfvars_path = write_tfvars(cfg, tfvars_path)
 
     sh(["terraform", "init"], cwd=str(TF_DIR))
-    sh(["terraform", "plan", "-var-file", str(tfvars_path), "-out", "tfplan"], cwd=str(TF_DIR))
-    sh(["terraform", "apply", "tfplan"], cwd=str(TF_DIR))
+    tf_plan_apply(tfvars_path, parallelism, refresh)
 
     out_json = sh(["terraform", "output", "-json"], cwd=str(TF_DIR), capture=True)
     outputs = json.loads(out_json)
@@ -262,7 +309,6 @@ def run(config, loop, interval):
 
 
 if __name__ == "__main__":
-    import shutil
     try:
         cli()
     except subprocess.CalledProcessError as e:
@@ -9,27 +9,79 @@ AzLure cheap log pipeline:
 
 import os
 import sys
+import re
 import json
-import gzip
+import zlib
 import sqlite3
 import argparse
+import asyncio
+import functools
 import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Any, Iterable, List, Optional
+from typing import AsyncIterator, Dict, Any, Iterable, List, Optional, Set, Tuple
 
 import yaml
-import requests
+import aiohttp
 from dateutil import parser as dtp
-from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import AzureError
+from azure.storage.blob.aio import BlobServiceClient
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is used otherwise
+    orjson = None
+
+try:
+    import ahocorasick  # pyahocorasick
+except ImportError:  # optional; rules fall back to plain substring checks
+    ahocorasick = None
+
+try:
+    # libyaml-backed loader; falls back to the pure-Python one if PyYAML was built without it
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
 
 
 # ---------------------------
 # Utilities
 # ---------------------------
 
+# path -> (st_mtime_ns, parsed config); configs are re-read every poll in --loop mode
+_YAML_CACHE: Dict[str, Tuple[int, Any]] = {}
+
 def load_yaml(path: str) -> Dict[str, Any]:
+    """Parse a YAML file, reusing the previous result while its mtime is unchanged."""
+    mtime = os.stat(path).st_mtime_ns
+    hit = _YAML_CACHE.get(path)
+    if hit and hit[0] == mtime:
+        return hit[1]
     with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        obj = yaml.load(f, Loader=_Loader)
+    _YAML_CACHE[path] = (mtime, obj)
+    return obj
+
+def dumps_json(obj: Any) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:  # e.g. integers wider than 64 bits
+            pass
+    return json.dumps(obj, ensure_ascii=False)
+
+# both accept bytes directly, so blobs are never decoded to an intermediate str
+loads_json = orjson.loads if orjson is not None else json.loads
+
+def loads_blob_json(b: bytes) -> Any:
+    """
+    loads_json for blob content. A document that fails to parse is retried once decoded
+    with errors="replace", so a stray invalid UTF-8 byte doesn't cost the records.
+    """
+    try:
+        return loads_json(b)
+    except ValueError:
+        return loads_json(b.decode("utf-8", errors="replace"))
 
 def now_iso() -> str:
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
@@ -37,24 +89,17 @@ def now_iso() -> str:
 def ensure_dir(p: Path):
     p.parent.mkdir(parents=True, exist_ok=True)
 
+# SAS query parameters; the value is replaced up to the next '&' or '#'
+_SAS_RE = re.compile(r"(?<=[?&])(sig|se|st|sp|spr|sv|skoid|sktid)=[^&#]*")
+
 def redact_sas(uri: Optional[str]) -> Optional[str]:
     if not uri:
         return uri
-    # Basic redaction of common SAS params
-    repl = uri
-    for key in ["sig", "se", "st", "sp", "spr", "sv", "skoid", "sktid"]:
-        repl = repl.replace(f"{key}=", f"{key}=REDACTED")
-    return repl
-
-def flatten(d: Dict[str, Any], prefix: str = "properties.") -> Dict[str, Any]:
-    """Return only 'properties' nested fields with a prefix, merged into root dict copy."""
-    out = dict(d)
-    props = d.get("properties") or {}
-    for k, v in props.items():
-        out[f"{prefix}{k}"] = v
-    return out
-
-def guess_category(container_name: str, record: Dict[str, Any]) -> str:
+    return _SAS_RE.sub(r"\1=REDACTED", uri)
+
+@functools.lru_cache(maxsize=64)
+def _container_category(container_name: str) -> Optional[str]:
+    """Category implied by the diagnostics container name, or None if it doesn't imply one."""
     c = container_name.lower()
     if "storageread" in c:
         return "StorageRead"
@@ -64,20 +109,28 @@ def guess_category(container_name: str, record: Dict[str, Any]) -> str:
         return "AuditEvent"
     if "activity" in c:
         return "Activity"
-    # fallback to record-provided category if present
-    return record.get("category") or "Unknown"
+    return None
 
-def normalize_event(container_name: str, rec: Dict[str, Any]) -> Dict[str, Any]:
+def normalize_event(container_cat: Optional[str], rec: Dict[str, Any]) -> Dict[str, Any]:
     """
     Normalize across Storage / KV / Activity record shapes.
     We prefer top-level fields, then look under properties.* for common keys.
+    `container_cat` is _container_category() of the source container, computed once per blob;
+    when it is None the record's own category is used.
     """
-    r = flatten(rec)
+    props = rec.get("properties")
+    if not isinstance(props, dict):
+        props = {}
 
     def g(*keys, default=None):
+        # "properties.x" keys read the nested properties dict directly (no flattened copy)
         for k in keys:
-            if k in r and r[k] not in (None, ""):
-                return r[k]
+            if k.startswith("properties."):
+                v = props.get(k[11:])
+            else:
+                v = rec.get(k)
+            if v not in (None, ""):
+                return v
         return default
 
     # time
@@ -106,7 +159,7 @@ def normalize_event(container_name: str, rec: Dict[str, Any]) -> Dict[str, Any]:
 
     return {
         "time": t,
-        "category": guess_category(container_name, r),
+        "category": container_cat or rec.get("category") or "Unknown",
         "operation_name": op,
         "request_uri": uri,
         "request_uri_redacted": redact_sas(uri),
@@ -115,63 +168,185 @@ def normalize_event(container_name: str, rec: Dict[str, Any]) -> Dict[str, Any]:
         "status_code": str(status) if status is not None else None,
         "auth_type": auth,
         "resource_id": rid,
-        "raw_json": json.dumps(rec, ensure_ascii=False),
+        "raw_json": dumps_json(rec),
     }
 
+def _iter_records(obj: Any) -> Iterable[Dict[str, Any]]:
+    """Records of one parsed document: {"records": [...]}, [...] or a single object."""
+    if isinstance(obj, dict) and isinstance(obj.get("records"), list):
+        obj = obj["records"]
+    if isinstance(obj, list):
+        for rec in obj:
+            if isinstance(rec, dict):
+                yield rec
+    elif isinstance(obj, dict):
+        yield obj
+
 def parse_blob_bytes(b: bytes) -> Iterable[Dict[str, Any]]:
     """
     Handle Azure diagnostics formats:
     - JSON with {"records": [...]}
     - JSON array [...]
     - NDJSON (one JSON per line)
+    The format is picked from the first non-whitespace byte (plus a "records" key near
+    the start), so NDJSON blobs don't pay for a failed whole-blob parse first.
     """
-    body = b.decode("utf-8", errors="replace").strip()
-    if not body:
-        return []
+    i, n = 0, len(b)
+    while i < n and b[i] in b" \t\r\n":
+        i += 1
+    if i == n:
+        return
 
-    # Try records wrapper
-    try:
-        obj = json.loads(body)
-        if isinstance(obj, dict) and "records" in obj and isinstance(obj["records"], list):
-            for rec in obj["records"]:
-                if isinstance(rec, dict):
-                    yield rec
-            return
-        if isinstance(obj, list):
-            for rec in obj:
-                if isinstance(rec, dict):
-                    yield rec
-            return
-        if isinstance(obj, dict):
-            yield obj
+    head = b[i:i + 1]
+    if head == b"[" or (head == b"{" and b'"records"' in b[i:i + 64]):
+        try:
+            obj = loads_blob_json(b)
+        except ValueError:  # JSONDecodeError (stdlib and orjson)
+            pass
+        else:
+            yield from _iter_records(obj)
             return
-    except json.JSONDecodeError:
-        pass
 
-    # NDJSON fallback
-    for line in body.splitlines():
-        line = line.strip()
-        if not line:
+    # NDJSON
+    first = True
+    for line in b.split(b"\n"):
+        if not line or line.isspace():
             continue
         try:
-            rec = json.loads(line)
-            if isinstance(rec, dict):
-                yield rec
-        except json.JSONDecodeError:
+            obj = loads_blob_json(line)
+        except ValueError:
+            if first:
+                # safety net: not line-delimited after all, e.g. a pretty-printed object
+                first = False
+                try:
+                    obj = loads_blob_json(b)
+                except ValueError:
+                    continue
+                yield from _iter_records(obj)
+                return
             continue
+        first = False
+        yield from _iter_records(obj)
+
+class RecordStream:
+    """
+    Incremental parser for chunked downloads: feed() bytes as they arrive and get back
+    the records completed so far, then call finish() once at the end.
+    Lines are parsed as soon as they are complete, so NDJSON blobs are never held in
+    memory whole. If the first non-blank line is not valid JSON by itself the blob is
+    a multi-line document: the remainder is buffered and parsed by parse_blob_bytes.
+    """
+
+    def __init__(self):
+        self._leftover = b""
+        self._first = True
+        self._buffered: Optional[List[bytes]] = None
+
+    def feed(self, chunk: bytes) -> List[Dict[str, Any]]:
+        if self._buffered is not None:
+            self._buffered.append(chunk)
+            return []
+        *lines, self._leftover = (self._leftover + chunk).split(b"\n")
+        return self._parse_lines(lines)
+
+    def finish(self) -> List[Dict[str, Any]]:
+        out = []
+        if self._buffered is None:
+            lines, self._leftover = [self._leftover], b""
+            out = self._parse_lines(lines)
+        if self._buffered is not None:
+            out.extend(parse_blob_bytes(b"".join(self._buffered)))
+        return out
+
+    def _parse_lines(self, lines: List[bytes]) -> List[Dict[str, Any]]:
+        out = []
+        for i, line in enumerate(lines):
+            if not line or line.isspace():
+                continue
+            try:
+                obj = loads_blob_json(line)
+            except ValueError:
+                if self._first:
+                    self._buffered = [b"\n".join(lines[i:] + [self._leftover])]
+                    self._leftover = b""
+                    return out
+                continue
+            self._first = False
+            out.extend(_iter_records(obj))
+        return out
+
+def parse_blob_chunks(chunks: Iterable[bytes]) -> Iterable[Dict[str, Any]]:
+    """parse_blob_bytes over an iterable of chunks, without joining them first."""
+    stream = RecordStream()
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.finish()
+
+
+class GunzipStream:
+    """Incremental gzip decoder (multi-member aware); data without the gzip magic passes through."""
+
+    def __init__(self):
+        self._is_gzip: Optional[bool] = None
+        self._head = b""  # leading bytes held back until the 2-byte magic can be checked
+        self._d = None
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self._is_gzip is None:
+            self._head += chunk
+            if len(self._head) < 2:
+                return b""
+            chunk, self._head = self._head, b""
+            self._is_gzip = chunk.startswith(b"\x1f\x8b")
+        if not self._is_gzip:
+            return chunk
+        out = []
+        while chunk:
+            if self._d is None:
+                if not chunk.strip(b"\x00"):  # zero padding after the last member
+                    break
+                self._d = zlib.decompressobj(wbits=31)
+            out.append(self._d.decompress(chunk))
+            if not self._d.eof:
+                break
+            chunk, self._d = self._d.unused_data, None
+        return b"".join(out)
+
+    def finish(self) -> bytes:
+        """A lone leading byte feed() was still holding back (a 1-byte blob is not gzip)."""
+        head, self._head = self._head, b""
+        return head
 
 
 # ---------------------------
 # Storage client
 # ---------------------------
 
+# Max blobs downloading concurrently (bounded with a semaphore in run_once)
+DOWNLOAD_CONCURRENCY = 32
+# Blobs are streamed in ranges of this size rather than read into memory whole
+MAX_CHUNK_GET_SIZE = 4 * 1024 * 1024
+# Events are written as they are parsed, in batches of this size, so a blob's events
+# are never all held at once (one commit per batch; the last one also marks the blob)
+EVENT_BATCH_SIZE = 1000
+
 class LogBlobReader:
+    """Async reader over the diagnostics containers; use it from inside a running event loop."""
+
     def __init__(self, connection_string: str, containers: List[str], since_minutes: int = 1440):
-        self.client = BlobServiceClient.from_connection_string(connection_string)
+        self.client = BlobServiceClient.from_connection_string(
+            connection_string,
+            connection_data_block_size=256 * 1024,
+            max_single_get_size=MAX_CHUNK_GET_SIZE,
+            max_chunk_get_size=MAX_CHUNK_GET_SIZE,
+        )
         self.containers = containers
         self.since_minutes = since_minutes
 
-    def iter_blobs(self) -> Iterable[Dict[str, Any]]:
+    async def close(self):
+        await self.client.close()
+
+    async def iter_blobs(self) -> AsyncIterator[Dict[str, Any]]:
         """
         Yield dicts: {"container": name, "blob_name": name, "etag": etag}
         Only recent blobs (since_minutes) to reduce cost/time.
@@ -182,7 +357,7 @@ class LogBlobReader:
         for c in self.containers:
             container = self.client.get_container_client(c)
             try:
-                for b in container.list_blobs():
+                async for b in container.list_blobs():
                     # Many diag blobs follow /y=/m=/d=/h= paths; we filter by last modified
                     if getattr(b, "last_modified", None) and b.last_modified.tzinfo:
                         if b.last_modified < cutoff:
@@ -191,26 +366,40 @@ class LogBlobReader:
             except Exception as e:
                 print(f"[warn] cannot list container {c}: {e}")
 
-    def download_blob(self, container: str, blob_name: str) -> bytes:
+    async def download_blob(self, container: str, blob_name: str) -> AsyncIterator[bytes]:
+        """Yield the blob's content in MAX_CHUNK_GET_SIZE ranges as they arrive."""
         bc = self.client.get_container_client(container).get_blob_client(blob_name)
-        data = bc.download_blob().readall()
+        downloader = await bc.download_blob()
         # Some logs may be gz; try to detect
-        if blob_name.endswith(".gz"):
-            try:
-                return gzip.decompress(data)
-            except Exception:
-                return data
-        return data
+        gunzip = GunzipStream() if blob_name.endswith(".gz") else None
+        async for chunk in downloader.chunks():
+            yield gunzip.feed(chunk) if gunzip else chunk
+        if gunzip:
+            yield gunzip.finish()
 
 
 # ---------------------------
 # DB & state
 # ---------------------------
 
+_INSERT_EVENT = """
+    INSERT INTO events(time, category, operation_name, request_uri, request_uri_redacted,
+      caller_ip, user_agent, status_code, auth_type, resource_id, raw_json, container, blob_name, inserted_at)
+    VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
 class EventStore:
     def __init__(self, db_path: str):
         ensure_dir(Path(db_path))
-        self.conn = sqlite3.connect(db_path)
+        # autocommit mode; writes are grouped explicitly via transaction()
+        self.conn = sqlite3.connect(db_path, isolation_level=None)
+        # single appending writer + dashboard readers: WAL lets readers run alongside the
+        # writer, and synchronous=NORMAL only fsyncs at checkpoints instead of every commit
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("PRAGMA cache_size=-65536")  # 64 MiB
+        self.conn.execute("PRAGMA mmap_size=268435456")  # 256 MiB
         self.conn.execute("""
             CREATE TABLE IF NOT EXISTS events (
               id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -247,37 +436,76 @@ class EventStore:
               created_at TEXT
             );
         """)
-        self.conn.commit()
+        # dashboard filters on time and groups by caller_ip / redacted URI; alerts join on event_id
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_events_time ON events(time)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_events_caller_ip ON events(caller_ip)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_events_uri ON events(request_uri_redacted)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_event ON alerts(event_id)")
+
+    def processed_blob_keys(self) -> Set[Tuple[str, str]]:
+        """All (container, blob_name) pairs already ingested, for O(1) membership checks."""
+        return set(self.conn.execute("SELECT container, blob_name FROM processed_blobs").fetchall())
 
     def blob_processed(self, container: str, blob_name: str, etag: Optional[str]) -> bool:
+        """Point lookup; run_once uses processed_blob_keys() instead of calling this per blob."""
         cur = self.conn.execute(
             "SELECT 1 FROM processed_blobs WHERE container=? AND blob_name=?",
             (container, blob_name))
         return cur.fetchone() is not None
 
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """Group writes into a single commit: `with store.transaction(): ...`."""
+        self.conn.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
     def mark_blob(self, container: str, blob_name: str, etag: Optional[str]):
         self.conn.execute(
             "INSERT OR REPLACE INTO processed_blobs(container, blob_name, etag, processed_at) VALUES(?,?,?,?)",
             (container, blob_name, etag, now_iso()))
-        self.conn.commit()
-
-    def add_event(self, container: str, blob_name: str, ev: Dict[str, Any]) -> int:
-        cur = self.conn.execute("""
-            INSERT INTO events(time, category, operation_name, request_uri, request_uri_redacted,
-              caller_ip, user_agent, status_code, auth_type, resource_id, raw_json, container, blob_name, inserted_at)
-            VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """, (
+
+    def _event_row(self, container: str, blob_name: str, ev: Dict[str, Any], inserted_at: str) -> tuple:
+        return (
             ev.get("time"), ev.get("category"), ev.get("operation_name"), ev.get("request_uri"), ev.get("request_uri_redacted"),
             ev.get("caller_ip"), ev.get("user_agent"), ev.get("status_code"), ev.get("auth_type"), ev.get("resource_id"),
-            ev.get("raw_json"), container, blob_name, now_iso()
-        ))
-        self.conn.commit()
-        return int(cur.lastrowid)
+            ev.get("raw_json"), container, blob_name, inserted_at
+        )
 
-    def add_alert(self, rule_name: str, event_id: int):
-        self.conn.execute("INSERT INTO alerts(rule_name, event_id, created_at) VALUES(?,?,?)",
-                          (rule_name, event_id, now_iso()))
-        self.conn.commit()
+    def add_events_bulk(self, container: str, blob_name: str, evs: List[Dict[str, Any]]) -> List[int]:
+        """
+        Insert all events of a blob with one executemany and return their ids in order.
+        Must run inside transaction(): AUTOINCREMENT ids are then contiguous, so they
+        are recovered from sqlite_sequence (executemany does not set lastrowid).
+        """
+        if not evs:
+            return []
+        ts = now_iso()
+        self.conn.executemany(_INSERT_EVENT, [self._event_row(container, blob_name, ev, ts) for ev in evs])
+        last = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name='events'").fetchone()[0]
+        return list(range(last - len(evs) + 1, last + 1))
+
+    def discard_events(self, id_ranges: List[Tuple[int, int]]):
+        """Delete events (and their alerts) by inclusive id range, e.g. a blob's batches written before it failed."""
+        if not id_ranges:
+            return
+        with self.transaction():
+            for first, last in id_ranges:
+                self.conn.execute("DELETE FROM alerts WHERE event_id BETWEEN ? AND ?", (first, last))
+                self.conn.execute("DELETE FROM events WHERE id BETWEEN ? AND ?", (first, last))
+
+    def add_alerts_bulk(self, alerts: List[Tuple[str, int]]):
+        """Insert (rule_name, event_id) pairs with one executemany."""
+        ts = now_iso()
+        self.conn.executemany("INSERT INTO alerts(rule_name, event_id, created_at) VALUES(?,?,?)",
+                              [(rule_name, event_id, ts) for rule_name, event_id in alerts])
 
 
 # ---------------------------
@@ -285,16 +513,40 @@ class EventStore:
 # ---------------------------
 
 class AlertDispatcher:
+    # pending webhook posts; beyond this alerts are dropped (with a warning) rather than stalling ingestion
+    QUEUE_SIZE = 1000
+    # how long close() waits for queued posts to go out
+    FLUSH_TIMEOUT = 30
+
     def __init__(self, cfg: Dict[str, Any]):
         self.cfg = cfg
+        # webhook posts go through a queue drained by one background task on a single
+        # keep-alive session; both are created on first use, inside the event loop
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self._drainer: Optional[asyncio.Task] = None
+
+    async def close(self):
+        if self.queue is not None:
+            try:
+                await asyncio.wait_for(self.queue.join(), self.FLUSH_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"[warn] webhook: {self.queue.qsize()} alert(s) not delivered")
+            self._drainer.cancel()
+        if self.session is not None:
+            await self.session.close()
 
     def send(self, rule_name: str, ev: Dict[str, Any]):
+        """Print the alert and queue its webhook post; never waits on the network."""
         if self.cfg.get("stdout", True):
             print(f"[ALERT] {rule_name} | {ev.get('time')} | {ev.get('category')} | {ev.get('request_uri_redacted')} | IP={ev.get('caller_ip')}")
         w = self.cfg.get("webhook", {})
         if w.get("enabled") and w.get("url"):
+            if self.queue is None:
+                self.queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+                self._drainer = asyncio.ensure_future(self._drain(w["url"], bool(w.get("batch"))))
             try:
-                requests.post(w["url"], json={
+                self.queue.put_nowait({
                     "text": f"AzLure alert: {rule_name}",
                     "rule": rule_name,
                     "event": {
@@ -306,44 +558,118 @@ class AlertDispatcher:
                         "status_code": ev.get("status_code"),
                         "auth_type": ev.get("auth_type"),
                     }
-                }, timeout=5)
+                })
+            except asyncio.QueueFull:
+                print(f"[warn] webhook queue full, dropping alert: {rule_name}")
+
+    async def _drain(self, url: str, batch: bool):
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+        while True:
+            payloads = [await self.queue.get()]
+            if batch:
+                # everything already queued goes out as one JSON array
+                while not self.queue.empty():
+                    payloads.append(self.queue.get_nowait())
+            try:
+                async with self.session.post(url, json=payloads if batch else payloads[0]):
+                    pass
             except Exception as e:
                 print(f"[warn] webhook failed: {e}")
+            finally:
+                for _ in payloads:
+                    self.queue.task_done()
+
+
+# Field values shorter than this are checked with plain `in`; the automaton only pays off on longer strings
+AHOCORASICK_MIN_LEN = 32
 
+class RuleMatcher:
+    """
+    All alert rules compiled together; match(ev) returns the names of the rules that fire.
+    Each rule's `when` clause is resolved once up front; a malformed rule raises ValueError. The `contains` substrings of all
+    rules on the same field share one Aho-Corasick automaton (when pyahocorasick is
+    installed), so a field is scanned once per event regardless of how many rules
+    and indicators look at it.
+    """
 
-def event_matches(rule: Dict[str, Any], ev: Dict[str, Any]) -> bool:
-    when = rule.get("when", {})
-    # category
-    cat = when.get("category")
-    if cat and (ev.get("category") != cat):
-        return False
-    # contains (string contains conditions)
-    contains = when.get("contains")
-    if contains:
-        field = contains.get("field")
-        if not field:
-            return False
+    def __init__(self, rules: List[Dict[str, Any]]):
+        # (name, category, field, all_of, any_of); all_of/any_of are None when the group is absent
+        self._rules: List[Tuple[Any, Optional[str], Optional[str], Optional[Set[str]], Optional[Set[str]]]] = []
+        needles: Dict[str, Set[str]] = {}
+        for rule in rules:
+            try:
+                when = rule.get("when", {})
+                contains = when.get("contains")
+                field = contains.get("field") if contains else None
+                if contains and not field:
+                    continue  # never matches
+                all_of = any_of = None
+                # str(): YAML turns indicators like 403 into ints
+                if contains and "all" in contains:
+                    all_of = {str(s).lower() for s in contains["all"]} - {""}  # "" is in every string
+                if contains and "any" in contains:
+                    any_of = {str(s).lower() for s in contains["any"]}
+                    if "" in any_of:
+                        any_of = None
+            except (AttributeError, TypeError) as e:
+                raise ValueError(f"invalid rule {rule!r}: {e}") from e
+            if field:
+                needles.setdefault(field, set()).update(all_of or (), any_of or ())
+            self._rules.append((rule.get("name"), when.get("category"), field, all_of, any_of))
+
+        self._needles = needles
+        self._automata = {}
+        if ahocorasick is not None:
+            for field, words in needles.items():
+                if words:
+                    automaton = ahocorasick.Automaton()
+                    for w in words:
+                        automaton.add_word(w, w)
+                    automaton.make_automaton()
+                    self._automata[field] = automaton
+
+    def _hits(self, field: str, ev: Dict[str, Any]) -> Set[str]:
+        """The rule substrings (for this field) that occur in the event's value."""
         val = ev.get(field) or ""
         # ensure lower-case match for safety
-        val_l = str(val).lower()
-        # all-of
-        if "all" in contains:
-            if not all(s.lower() in val_l for s in contains["all"]):
-                return False
-        # any-of
-        if "any" in contains:
-            if not any(s.lower() in val_l for s in contains["any"]):
-                return False
-    return True
+        val_l = val.lower() if isinstance(val, str) else str(val).lower()
+        automaton = self._automata.get(field)
+        if automaton is not None and len(val_l) >= AHOCORASICK_MIN_LEN:
+            return {w for _, w in automaton.iter(val_l)}
+        return {w for w in self._needles[field] if w in val_l}
+
+    def match(self, ev: Dict[str, Any]) -> List[Any]:
+        fired = []
+        hits_by_field: Dict[str, Set[str]] = {}
+        for name, cat, field, all_of, any_of in self._rules:
+            if cat and ev.get("category") != cat:
+                continue
+            if field:
+                hits = hits_by_field.get(field)
+                if hits is None:
+                    hits = hits_by_field[field] = self._hits(field, ev)
+                if all_of is not None and not all_of <= hits:
+                    continue
+                if any_of is not None and not any_of & hits:
+                    continue
+            fired.append(name)
+        return fired
 
 
 # ---------------------------
 # Main runner
 # ---------------------------
 
-def run_once(cfg: Dict[str, Any]) -> None:
+def _connection_string(cfg: Dict[str, Any]) -> Optional[str]:
+    return (cfg.get("storage", {}) or {}).get("connection_string") or os.getenv("AZURE_STORAGE_CONNECTION_STRING_LOGS")
+
+def _poll_interval(cfg: Dict[str, Any], override: Optional[int]) -> int:
+    return override or int((cfg.get("polling", {}) or {}).get("interval_seconds", 60))
+
+def build_pipeline(cfg: Dict[str, Any]) -> Tuple[LogBlobReader, EventStore, AlertDispatcher]:
+    """Create the long-lived reader/store/dispatcher; reused across polls in --loop mode."""
     # connection string
-    conn_str = (cfg.get("storage", {}) or {}).get("connection_string") or os.getenv("AZURE_STORAGE_CONNECTION_STRING_LOGS")
+    conn_str = _connection_string(cfg)
     if not conn_str:
         print("ERROR: no storage connection string provided. Set AZURE_STORAGE_CONNECTION_STRING_LOGS or config.storage.connection_string")
         sys.exit(2)
@@ -355,36 +681,117 @@ def run_once(cfg: Dict[str, Any]) -> None:
     reader = LogBlobReader(conn_str, containers, since_minutes=since)
     store = EventStore(db_path)
     dispatcher = AlertDispatcher(cfg.get("alerts", {}))
-    rules = cfg.get("rules", [])
+    return reader, store, dispatcher
+
+async def close_pipeline(reader: LogBlobReader, store: EventStore, dispatcher: AlertDispatcher) -> None:
+    await reader.close()
+    await dispatcher.close()
+    store.close()
+
+def build_rules(cfg: Dict[str, Any]) -> RuleMatcher:
+    """Compile the config's rules; done once per loaded config, not per poll."""
+    return RuleMatcher(cfg.get("rules") or [])
 
-    # iterate blobs
-    for meta in reader.iter_blobs():
+async def run_once(rules: RuleMatcher, reader: LogBlobReader, store: EventStore, dispatcher: AlertDispatcher) -> None:
+    seen = store.processed_blob_keys()
+    sem = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+    async def process(meta: Dict[str, Any]) -> None:
         c = meta["container"]
         name = meta["blob_name"]
         etag = meta.get("etag")
-        if store.blob_processed(c, name, etag):
-            continue
 
-        try:
-            raw = reader.download_blob(c, name)
-        except Exception as e:
-            print(f"[warn] download failed {c}/{name}: {e}")
-            continue
+        container_cat = _container_category(c)
+        stream = RecordStream()
+        evs: List[Dict[str, Any]] = []
+        written: List[Tuple[int, int]] = []  # id ranges of this blob's batches already committed
+
+        def flush(done: bool) -> None:
+            # rules run on the in-memory events first, so the transaction only does inserts.
+            # There is no await inside, so this runs to completion before any other task
+            # touches the (single-threaded) sqlite connection. The last batch also marks the blob.
+            matched = [(i, rule_name) for i, ev in enumerate(evs) for rule_name in rules.match(ev)]
+            with store.transaction():
+                ids = store.add_events_bulk(c, name, evs)
+                store.add_alerts_bulk([(rule_name, ids[i]) for i, rule_name in matched])
+                if done:
+                    store.mark_blob(c, name, etag)
+            if ids:
+                written.append((ids[0], ids[-1]))
+            for i, rule_name in matched:
+                dispatcher.send(rule_name, evs[i])
+            evs.clear()
+
+        def abandon(what: str, e: Exception) -> None:
+            # drop the batches already written and leave the blob unmarked, so the
+            # next poll retries it whole without duplicating events
+            print(f"[warn] {what} failed {c}/{name}: {e}")
+            store.discard_events(written)
+
+        async with sem:
+            try:
+                async for chunk in reader.download_blob(c, name):
+                    evs.extend(normalize_event(container_cat, rec) for rec in stream.feed(chunk))
+                    if len(evs) >= EVENT_BATCH_SIZE:
+                        flush(done=False)
+                evs.extend(normalize_event(container_cat, rec) for rec in stream.finish())
+            except AzureError as e:
+                abandon("download", e)
+                return
+            except sqlite3.Error as e:
+                abandon("store", e)
+                return
+            except Exception as e:
+                print(f"[warn] parse failed {c}/{name}: {e}")
 
-        try:
-            for rec in parse_blob_bytes(raw):
-                ev = normalize_event(c, rec)
-                ev_id = store.add_event(c, name, ev)
-                # rules
-                for rule in rules:
-                    if event_matches(rule, ev):
-                        store.add_alert(rule["name"], ev_id)
-                        dispatcher.send(rule["name"], ev)
-        except Exception as e:
-            print(f"[warn] parse failed {c}/{name}: {e}")
-
-        # mark processed
-        store.mark_blob(c, name, etag)
+            try:
+                flush(done=True)
+            except sqlite3.Error as e:
+                abandon("store", e)
+                return
+        seen.add((c, name))
+
+    # blobs start downloading while the listing is still being paged through
+    tasks, metas = [], []
+    async for meta in reader.iter_blobs():
+        if (meta["container"], meta["blob_name"]) not in seen:
+            metas.append(meta)
+            tasks.append(asyncio.ensure_future(process(meta)))
+    # one blob's failure must not abort the poll while its siblings are still running
+    for meta, res in zip(metas, await asyncio.gather(*tasks, return_exceptions=True)):
+        if isinstance(res, Exception):
+            print(f"[warn] processing failed {meta['container']}/{meta['blob_name']}: {res!r}")
+
+async def serve(config_path: str, cfg: Dict[str, Any], interval_override: Optional[int], once: bool) -> None:
+    rules = build_rules(cfg)
+    pipeline = build_pipeline(cfg)
+    try:
+        if once:
+            await run_once(rules, *pipeline)
+            return
+
+        # loop (config is re-read each cycle so rule edits apply without a restart;
+        # load_yaml only re-parses when the file's mtime changes and returns the same
+        # object otherwise, so clients and connections are rebuilt only on a real change)
+        interval = _poll_interval(cfg, interval_override)
+        while True:
+            try:
+                latest = load_yaml(config_path)
+                if latest is not cfg:
+                    if not isinstance(latest, dict) or not _connection_string(latest):
+                        raise ValueError("no storage connection string")
+                    new_interval = _poll_interval(latest, interval_override)
+                    new_rules = build_rules(latest)
+                    new_pipeline = build_pipeline(latest)
+                    await close_pipeline(*pipeline)
+                    cfg, rules, pipeline, interval = latest, new_rules, new_pipeline, new_interval
+            except (OSError, ValueError, yaml.YAMLError) as e:
+                # a half-written or broken edit must not take the daemon down
+                print(f"[warn] config reload failed, keeping the previous config: {e}")
+            await run_once(rules, *pipeline)
+            await asyncio.sleep(interval)
+    finally:
+        await close_pipeline(*pipeline)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -395,20 +802,12 @@ def main():
     args = ap.parse_args()
 
     cfg = load_yaml(args.config)
-    interval = args.interval or int((cfg.get("polling", {}) or {}).get("interval_seconds", 60))
 
     if args.once and args.loop:
         print("Choose either --once or --loop")
         sys.exit(2)
 
-    if args.once:
-        run_once(cfg)
-        return
-
-    # loop
-    while True:
-        run_once(cfg)
-        time.sleep(interval)
+    asyncio.run(serve(args.config, cfg, args.interval, args.once))
 
 if __name__ == "__main__":
     main()
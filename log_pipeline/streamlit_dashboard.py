@@ -1,4 +1,5 @@
 import sqlite3
+import time
 import pandas as pd
 import streamlit as st
 from pathlib import Path
@@ -11,7 +12,8 @@ if not DB_PATH.exists():
     st.warning(f"DB not found at {DB_PATH}. Run parser first.")
     st.stop()
 
-conn = sqlite3.connect(DB_PATH)
+# read-only so the dashboard never takes write locks away from the parser (DB runs in WAL mode)
+conn = sqlite3.connect(DB_PATH.resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
 
 st.subheader("Recent events")
 df = pd.read_sql_query("""
@@ -21,24 +23,27 @@ df = pd.read_sql_query("""
 """, conn)
 st.dataframe(df, use_container_width=True)
 
+# bind the cutoff as a value so the planner can use idx_events_time
+since_7d = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - 7 * 86400))
+
 st.subheader("Top caller IPs (last 7 days)")
 df_ips = pd.read_sql_query("""
   SELECT caller_ip, COUNT(*) as cnt
   FROM events
-  WHERE time >= datetime('now','-7 day')
+  WHERE time >= ?
   GROUP BY caller_ip
   ORDER BY cnt DESC LIMIT 20
-""", conn)
+""", conn, params=(since_7d,))
 st.bar_chart(df_ips.set_index("caller_ip"))
 
 st.subheader("Top URIs (last 7 days)")
 df_uri = pd.read_sql_query("""
-  SELECT request_uri, COUNT(*) as cnt
+  SELECT request_uri_redacted as request_uri, COUNT(*) as cnt
   FROM events
-  WHERE time >= datetime('now','-7 day')
-  GROUP BY request_uri
+  WHERE time >= ?
+  GROUP BY request_uri_redacted
   ORDER BY cnt DESC LIMIT 20
-""", conn)
+""", conn, params=(since_7d,))
 st.dataframe(df_uri, use_container_width=True)
 
 st.subheader("Alerts")
@@ -1,25 +1,113 @@
 # mock_imds/app.py
 from flask import Flask, request, jsonify
-import datetime, os
+import datetime, os, sys, json, queue, threading, time, uuid, atexit, signal
+from azure.core.exceptions import ResourceExistsError
 from azure.storage.blob import BlobServiceClient
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 app = Flask(__name__)
 
 FORensics_CONNSTR = os.environ.get("FORENSICS_CONNSTR")  # connection string for a forensics container
 FOR_CONTAINER = os.environ.get("FORENSICS_CONTAINER", "forensics-logs")
 
-def save_log(payload):
-    if not FORensics_CONNSTR:
-        print("[forensics]", payload)
-        return
-    client = BlobServiceClient.from_connection_string(FORensics_CONNSTR)
-    cont = client.get_container_client(FOR_CONTAINER)
+# Log entries are uploaded by a background thread, batched as NDJSON blobs,
+# so request latency never includes the Azure upload.
+FLUSH_EVERY = 64        # entries per blob
+FLUSH_INTERVAL = 5.0    # seconds; a partial batch is flushed after this long
+RETRY_DELAY = 5.0       # seconds between attempts at a batch whose upload failed
+EXIT_TIMEOUT = 30.0     # seconds the exit hook waits for the final flush
+
+_log_q = queue.Queue()
+_STOP = object()              # queued by the exit hook after everything else
+_stopping = threading.Event()
+_cont = None                  # forensics ContainerClient, created by the writer on first upload
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def _dumps(entry):
+    if orjson is not None:
+        return orjson.dumps(entry)
+    return json.dumps(entry).encode("utf-8")
+
+def _forensics_container():
+    cont = BlobServiceClient.from_connection_string(FORensics_CONNSTR).get_container_client(FOR_CONTAINER)
     try:
         cont.create_container()
-    except Exception:
+    except ResourceExistsError:
         pass
-    name = "imds-log-" + datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ") + ".json"
-    cont.get_blob_client(name).upload_blob(payload.encode('utf-8'), overwrite=True)
+    return cont
+
+def _upload_batch(batch):
+    global _cont
+    if _cont is None:
+        _cont = _forensics_container()
+    # pid + uuid keep names unique across workers and restarts; never overwrite an earlier batch
+    name = "imds-log-{}-{}-{}.ndjson".format(_utcnow().strftime("%Y%m%dT%H%M%SZ"), os.getpid(), uuid.uuid4().hex)
+    _cont.get_blob_client(name).upload_blob(b"\n".join(batch) + b"\n", overwrite=False)
+
+def _fill(batch):
+    """Top `batch` up from the queue until it is full or FLUSH_INTERVAL passes; True once _STOP is seen."""
+    deadline = time.monotonic() + FLUSH_INTERVAL
+    while len(batch) < FLUSH_EVERY:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            item = _log_q.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is _STOP:
+            return True
+        batch.append(item)
+    return False
+
+def _log_writer():
+    batch = []
+    while True:
+        if not batch:
+            item = _log_q.get()
+            if item is _STOP:
+                return
+            batch.append(item)
+        stop = _fill(batch)
+        try:
+            _upload_batch(batch)
+            batch = []
+        except Exception as e:
+            if _stopping.is_set():
+                # last chance: keep the entries in the process output rather than lose them
+                print("[forensics] upload failed at exit, dumping {} entries: {}".format(len(batch), e))
+                for payload in batch:
+                    print("[forensics]", payload.decode("utf-8"))
+                batch = []
+            else:
+                # keep the batch and try it again; new entries wait in the queue meanwhile
+                print("[forensics] upload failed, retrying {} entries: {}".format(len(batch), e))
+                _stopping.wait(RETRY_DELAY)
+        if stop:
+            return
+
+def _flush_on_exit():
+    _stopping.set()
+    _log_q.put(_STOP)
+    _writer.join(timeout=EXIT_TIMEOUT)
+
+if FORensics_CONNSTR:
+    _writer = threading.Thread(target=_log_writer, daemon=True)
+    _writer.start()
+    atexit.register(_flush_on_exit)
+
+def save_log(entry):
+    payload = _dumps(entry)
+    if not FORensics_CONNSTR:
+        print("[forensics]", payload.decode("utf-8"))
+        return
+    _log_q.put(payload)
 
 @app.route("/metadata/identity/oauth2/token", methods=["GET","POST"])
 def token():
@@ -31,17 +119,17 @@ def token():
     remote = request.remote_addr
 
     entry = {
-        "time": datetime.datetime.utcnow().isoformat(),
+        "time": _utcnow().isoformat(),
         "remote_addr": remote,
         "headers": dict(request.headers),
         "args": request.args.to_dict()
     }
-    save_log(jsonify(entry).get_data(as_text=True))
+    save_log(entry)
 
     # reward the request (simulate MI token) if header present or Metadata true
     if metadata.lower() == "true" or secret == os.environ.get("BACKUP_IDENTITY_HEADER","BACKUP-SECRET"):
         token = {
-            "access_token": "FAKE_MI_TOKEN_{}".format(datetime.datetime.utcnow().strftime("%s")),
+            "access_token": "FAKE_MI_TOKEN_{}".format(int(_utcnow().timestamp())),
             "expires_in": 3599,
             "token_type": "Bearer"
         }
@@ -50,4 +138,6 @@ def token():
         return jsonify({"error":"Unauthorized - missing Metadata or secret header"}), 401
 
 if __name__ == "__main__":
+    # turn SIGTERM into a normal exit so the atexit flush runs
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     app.run(host="0.0.0.0", port=8080)
@@ -2,73 +2,217 @@
 # seeder/seed_backup_paths.py
 # Usage:
 #   python seed_backup_paths.py --connstr "<storage_connstr>" --kv-name "backup-vault" --resource-group "honeypot-rg"
+#   (add --credential cli after 'az login' to skip the DefaultAzureCredential probing chain)
 
-import argparse, datetime, os, json
+import argparse, asyncio, functools, os, sys, json, io, tarfile, time
 from jinja2 import Environment, FileSystemLoader
-from azure.storage.blob import BlobServiceClient
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
+# azure.* SDK modules are imported where first used: they are slow to import
+# (msal, cryptography, ...) and --help / argument errors never need them
 
 HERE = os.path.dirname(__file__)
 TEMPLATES = os.path.join(HERE, "templates")
 
+# one Environment for all renders so compiled templates are cached and reused
+_env = Environment(loader=FileSystemLoader(TEMPLATES), auto_reload=False, cache_size=400)
+
+# the seeded templates, loaded and compiled once at import
+TEMPLATE_NAMES = ("deploy_history.txt.j2", "id_rsa.template", "foothold.txt.j2")
+_TPL = {name: _env.get_template(name) for name in TEMPLATE_NAMES}
+
+def render_bytes(tpl, ctx):
+    """Render straight to UTF-8 bytes, encoding chunk by chunk instead of building the whole str first."""
+    buf = io.BytesIO()
+    for chunk in tpl.generate(ctx):
+        buf.write(chunk.encode('utf-8'))
+    return buf.getvalue()
+
+@functools.lru_cache(maxsize=64)
+def _render_cached(name, ctx_items):
+    tpl = _TPL.get(name) or _env.get_template(name)
+    return render_bytes(tpl, dict(ctx_items))
+
 def render_template(name, ctx):
-    env = Environment(loader=FileSystemLoader(TEMPLATES))
-    tpl = env.get_template(name)
-    return tpl.render(**ctx)
-
-def upload_blob(conn_str, container, blob_name, data):
-    client = BlobServiceClient.from_connection_string(conn_str)
-    container_client = client.get_container_client(container)
-    try:
-        container_client.create_container()
-    except Exception:
-        pass
-    blob_client = container_client.get_blob_client(blob_name)
-    blob_client.upload_blob(data.encode('utf-8'), overwrite=True)
-    print(f"[+] Uploaded {blob_name} to {container}")
-
-def put_kv_secret(kv_name, secret_name, secret_value):
-    kv_url = f"https://{kv_name}.vault.azure.net"
-    cred = DefaultAzureCredential()
-    client = SecretClient(vault_url=kv_url, credential=cred)
-    client.set_secret(secret_name, secret_value)
-    print(f"[+] Put secret {secret_name} into {kv_name}")
-
-def main():
+    """Rendered UTF-8 bytes of template `name`; repeat renders with an equal ctx come from cache."""
+    return _render_cached(name, tuple(sorted(ctx.items())))
+
+def parse_connstr(conn_str):
+    """'Key=Value;...' storage connection string -> dict (values may themselves contain '=')."""
+    return dict(kv.split("=", 1) for kv in conn_str.split(";") if "=" in kv)
+
+def blob_service(conn_str):
+    """Async BlobServiceClient; use as `async with blob_service(...) as svc`."""
+    from azure.storage.blob.aio import BlobServiceClient
+    # the aiohttp transport pools keep-alive connections per client (up to 100), enough for the concurrent uploads
+    kw = dict(connection_timeout=5, read_timeout=30)  # the only place the seeder sets storage timeouts
+    parts = parse_connstr(conn_str)
+    acct, key = parts.get("AccountName"), parts.get("AccountKey")
+    if not (acct and key) or "SharedAccessSignature" in parts:
+        # SAS / emulator shorthand / anything unusual: let the SDK's parser sort it out
+        return BlobServiceClient.from_connection_string(conn_str, **kw)
+    from azure.core.credentials import AzureNamedKeyCredential
+    account_url = parts.get("BlobEndpoint") or "{}://{}.blob.{}".format(
+        parts.get("DefaultEndpointsProtocol", "https"), acct, parts.get("EndpointSuffix", "core.windows.net"))
+    return BlobServiceClient(account_url, credential=AzureNamedKeyCredential(acct, key), **kw)
+
+async def get_container(svc, container):
+    """Container client for the seeded blobs, creating the container if needed."""
+    from azure.core.exceptions import ResourceExistsError
+    container_client = svc.get_container_client(container)
+    # a HEAD is cheaper than a PUT that 409s on every re-run
+    if not await container_client.exists():
+        try:
+            await container_client.create_container()
+        except ResourceExistsError:
+            pass  # created concurrently between the HEAD and the PUT
+    return container_client
+
+async def upload_blob(container_client, blob_name, data):
+    """Upload already-encoded `data` (bytes); returns the status line. Larger payloads are staged in parallel blocks."""
+    await container_client.upload_blob(name=blob_name, data=data, overwrite=True, length=len(data),
+                                       max_concurrency=4)
+    return f"[+] Uploaded {blob_name} to {container_client.container_name}"
+
+_cred = None
+_secret_clients = {}  # kv_name -> SecretClient
+
+def make_credential(kind="default"):
+    """
+    'cli' and 'managed' go straight to that source; 'default' walks the whole
+    DefaultAzureCredential chain (env, managed identity, CLI, ...), which is slower.
+    """
+    from azure.identity import aio
+    if kind == "cli":
+        return aio.AzureCliCredential()
+    if kind == "managed":
+        return aio.ManagedIdentityCredential()
+    return aio.DefaultAzureCredential()
+
+def get_secret_client(kv_name, credential="default"):
+    """SecretClient per vault, all sharing one credential so it is resolved once per run."""
+    global _cred
+    client = _secret_clients.get(kv_name)
+    if client is None:
+        from azure.keyvault.secrets.aio import SecretClient
+        if _cred is None:
+            _cred = make_credential(credential)
+        client = SecretClient(vault_url=f"https://{kv_name}.vault.azure.net", credential=_cred)
+        _secret_clients[kv_name] = client
+    return client
+
+async def close_secret_clients():
+    global _cred
+    for client in _secret_clients.values():
+        await client.close()
+    _secret_clients.clear()
+    if _cred is not None:
+        await _cred.close()
+        _cred = None
+
+BUNDLE_NAME = "deploy_artifacts.tar.gz"
+
+def make_bundle(files):
+    """In-memory .tar.gz of (name, bytes) pairs."""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+async def put_kv_secret(kv_name, secret_name, secret_value, credential="default"):
+    await get_secret_client(kv_name, credential).set_secret(secret_name, secret_value)
+    return f"[+] Put secret {secret_name} into {kv_name}"
+
+DEFAULT_SECRETS = (("backupCredential", "FAKE_BACKUP_SECRET"),)
+
+def secret_pair(arg):
+    """argparse type for --secret NAME=VALUE."""
+    name, sep, value = arg.partition("=")
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {arg!r}")
+    return name, value
+
+async def seed_kv_secret(kv_name, secrets=DEFAULT_SECRETS, credential="default"):
+    # write Key Vault secrets (requires the identity/credential where this script runs to have SetSecret privilege)
+    secrets = dict(secrets)  # one write per name
+    results = await asyncio.gather(*(put_kv_secret(kv_name, name, value, credential) for name, value in secrets.items()),
+                                   return_exceptions=True)
+    msgs = []
+    for name, res in zip(secrets, results):
+        if isinstance(res, Exception):
+            res = (f"[!] Failed to write Key Vault secret {name}. Ensure this principal has SetSecret permission "
+                   f"or skip this step.\n{res}")
+        msgs.append(res)
+    return "\n".join(msgs)
+
+async def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--connstr", required=True)
     parser.add_argument("--container", default="public-backup")
     parser.add_argument("--kv-name", default="backup-vault")
     parser.add_argument("--resource-group", default="honeypot-rg")
+    parser.add_argument("--bundle", action="store_true",
+                        help=f"upload the artifacts as one {BUNDLE_NAME} plus foothold.txt pointing at it")
+    parser.add_argument("--secret", type=secret_pair, action="append", metavar="NAME=VALUE",
+                        help="extra Key Vault secret to seed (repeatable)")
+    parser.add_argument("--credential", choices=("default", "cli", "managed"), default="default",
+                        help="Key Vault credential: az CLI login, managed identity, or the full DefaultAzureCredential chain")
     args = parser.parse_args()
 
-    ts = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    ts = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
     ctx = {"timestamp": ts, "vault": args.kv_name}
 
-    # 1) seed deploy_history that contains an "id_rsa" entry (fake)
-    deploy_history = render_template("deploy_history.txt.j2", ctx)
-    upload_blob(args.connstr, args.container, "deploy_history.txt", deploy_history)
+    async with blob_service(args.connstr) as svc:
+        container_client = await get_container(svc, args.container)
+        if args.bundle:
+            # foothold's "Storage B pointer" leads to the archive
+            ctx["storage_b_url"] = container_client.get_blob_client(BUNDLE_NAME).url
 
-    # 2) seed id_rsa blob
-    id_rsa = render_template("id_rsa.template", ctx)
-    upload_blob(args.connstr, args.container, "id_rsa", id_rsa)
+        # every template sees the same ctx, so render them all in one pass
+        rendered = {name: render_template(name, ctx) for name in TEMPLATE_NAMES}
+        items = [
+            # 1) seed deploy_history that contains an "id_rsa" entry (fake)
+            ("deploy_history.txt", rendered["deploy_history.txt.j2"]),
+            # 2) seed id_rsa blob
+            ("id_rsa", rendered["id_rsa.template"]),
+            # 3) seed a foothold pointer that references the KeyVault (so attacker finds it)
+            ("foothold.txt", rendered["foothold.txt.j2"]),
+        ]
+        if args.bundle:
+            # two PUTs instead of three; foothold.txt stays a separate blob so it is still discoverable
+            items = [(BUNDLE_NAME, make_bundle(items)), items[-1]]
 
-    # 3) seed a foothold pointer that references the KeyVault (so attacker finds it)
-    foothold = render_template("foothold.txt.j2", ctx)
-    upload_blob(args.connstr, args.container, "foothold.txt", foothold)
+        # 4) the uploads and the Key Vault write are independent, so issue them all at once;
+        # gather returns their results in submission order whatever order they finish in, and
+        # with return_exceptions it waits for all of them, so nothing is in flight at close time
+        try:
+            results = await asyncio.gather(
+                *(upload_blob(container_client, name, body) for name, body in items),
+                # --secret values override the defaults; a repeated NAME keeps its last value
+                seed_kv_secret(args.kv_name, {**dict(DEFAULT_SECRETS), **dict(args.secret or ())}, args.credential),
+                return_exceptions=True,
+            )
+        finally:
+            await close_secret_clients()
 
-    # 4) write Key Vault secret (requires the identity/credential where this script runs to have SetSecret privilege)
-    # We use DefaultAzureCredential; run this locally after 'az login' or from a service principal.
-    try:
-        put_kv_secret(args.kv_name, "backupCredential", "FAKE_BACKUP_SECRET")
-    except Exception as e:
-        print("[!] Failed to write Key Vault secret. Ensure this principal has SetSecret permission or skip this step.")
-        print(e)
+    msgs = []
+    failed = False
+    for (name, _), res in zip(items, results):
+        if isinstance(res, Exception):
+            failed = True
+            res = f"[!] Failed to upload {name}: {res}"
+        msgs.append(res)
+    msgs.append(results[-1])  # Key Vault status
 
     # 5) print a simulated SAS url (SAFE FAKE)
-    fake_sas = f"https://{os.environ.get('SIMULATED_SAS_HOST','storageaccount')}.blob.core.windows.net/{args.container}/foothold.txt?sv=FAKE_SAS&sig=FAKE"
-    print("[+] Simulated SAS (FAKE):", fake_sas)
+    if not failed:
+        fake_sas = f"https://{os.environ.get('SIMULATED_SAS_HOST','storageaccount')}.blob.core.windows.net/{args.container}/foothold.txt?sv=FAKE_SAS&sig=FAKE"
+        msgs.append(f"[+] Simulated SAS (FAKE): {fake_sas}")
+    sys.stdout.write("\n".join(msgs) + "\n")
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
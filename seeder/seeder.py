@@ -1,10 +1,8 @@
 #!/usr/bin/env python3
 # Minimal seeder placeholder for future steps (not required for current Terraform)
-import click
 
-@click.command()
 def main():
-    click.echo("Seeder placeholder. Current deployment seeds via Terraform.")
+    print("Seeder placeholder. Current deployment seeds via Terraform.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,260 @@
+import asyncio
+import gzip
+import importlib.util
+import types
+from pathlib import Path
+
+import pytest
+
+# log_pipeline/parser.py needs the pipeline's requirements (log_pipeline/requirements.txt)
+pytest.importorskip("aiohttp")
+pytest.importorskip("azure.storage.blob.aio")
+
+_spec = importlib.util.spec_from_file_location(
+    "azlure_log_parser", Path(__file__).resolve().parents[1] / "log_pipeline" / "parser.py")
+P = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(P)
+
+CHUNK_SIZES = (1, 2, 3, 7, 64, 1 << 20)
+
+BLOBS = {
+    "records": (b'{"records": [{"a": 1}, {"b": 2}]}', [{"a": 1}, {"b": 2}]),
+    "array": (b'  [{"a": 1}, 5, {"b": 2}]\n', [{"a": 1}, {"b": 2}]),
+    "ndjson": (b'{"a": 1}\n\n{"b": 2}\n{"c": 3}', [{"a": 1}, {"b": 2}, {"c": 3}]),
+    "crlf": (b'{"a": 1}\r\n{"b": 2}\r\n', [{"a": 1}, {"b": 2}]),
+    "pretty_records": (b'{\n  "records": [\n    {"a": 1},\n    {"b": 2}\n  ]\n}\n', [{"a": 1}, {"b": 2}]),
+    "pretty_object": (b'{\n  "time": "t",\n  "b": 2\n}\n', [{"time": "t", "b": 2}]),
+    "garbage_first_line": (b'not json\n{"a": 1}\n{"b": 2}\n', [{"a": 1}, {"b": 2}]),
+    "garbage_middle_line": (b'{"a": 1}\n{oops\n{"b": 2}\n', [{"a": 1}, {"b": 2}]),
+    "invalid_utf8": (b'{"records":[{"uri":"/backup/credential\xff"},{"b":1}]}',
+                     [{"uri": "/backup/credential�"}, {"b": 1}]),
+    "blank": (b' \r\n\t\n', []),
+}
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+@pytest.mark.parametrize("name", sorted(BLOBS))
+def test_parse_blob_bytes(name):
+    data, expected = BLOBS[name]
+    assert list(P.parse_blob_bytes(data)) == expected
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+@pytest.mark.parametrize("name", sorted(BLOBS))
+def test_parse_blob_chunks_matches_bytes(name, size):
+    data, _ = BLOBS[name]
+    assert list(P.parse_blob_chunks(chunked(data, size))) == list(P.parse_blob_bytes(data))
+
+def gunzip(data, size):
+    g = P.GunzipStream()
+    return b"".join(g.feed(c) for c in chunked(data, size)) + g.finish()
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_gunzip_stream_multi_member(size):
+    data = gzip.compress(b'{"a": 1}\n') + gzip.compress(b'{"b": 2}\n') + b"\x00" * 16
+    assert gunzip(data, size) == b'{"a": 1}\n{"b": 2}\n'
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_gunzip_stream_passes_plain_data_through(size):
+    data = b'{"a": 1}\n{"b": 2}\n'
+    assert gunzip(data, size) == data
+    assert gunzip(b"{", size) == b"{"
+
+
+def baseline_event_matches(rule, ev):
+    """The original per-rule check RuleMatcher replaced; its semantics are the reference."""
+    when = rule.get("when", {})
+    cat = when.get("category")
+    if cat and (ev.get("category") != cat):
+        return False
+    contains = when.get("contains")
+    if contains:
+        field = contains.get("field")
+        if not field:
+            return False
+        val_l = str(ev.get(field) or "").lower()
+        if "all" in contains and not all(s.lower() in val_l for s in contains["all"]):
+            return False
+        if "any" in contains and not any(s.lower() in val_l for s in contains["any"]):
+            return False
+    return True
+
+LONG = "/backup/" + "x" * P.AHOCORASICK_MIN_LEN  # long enough to go through the automaton
+
+RULES = [
+    {"name": "empty-any", "when": {"contains": {"field": "request_uri", "any": []}}},
+    {"name": "empty-all", "when": {"contains": {"field": "request_uri", "all": []}}},
+    {"name": "blank-any", "when": {"contains": {"field": "request_uri", "any": [""]}}},
+    {"name": "blank-all", "when": {"contains": {"field": "request_uri", "all": ["", "BACKUP"]}}},
+    {"name": "no-field", "when": {"contains": {"any": ["backup"]}}},
+    {"name": "missing-field", "when": {"contains": {"field": "nope", "any": ["backup"]}}},
+    {"name": "missing-field-all", "when": {"contains": {"field": "nope", "all": [""]}}},
+    {"name": "category", "when": {"category": "StorageRead", "contains": {"field": "request_uri", "any": ["id_rsa"]}}},
+    {"name": "all-and-any", "when": {"contains": {"field": "request_uri", "all": ["backup", "x"], "any": ["id_rsa", "XXXX"]}}},
+    {"name": "status", "when": {"contains": {"field": "status_code", "any": ["40"]}}},
+    {"name": "no-when"},
+]
+
+EVENTS = [
+    {"category": "StorageRead", "request_uri": "/Backup/id_rsa", "status_code": "403"},
+    {"category": "StorageWrite", "request_uri": "/backup/id_rsa"},
+    {"category": "StorageRead", "request_uri": LONG, "status_code": "200"},
+    {"category": "StorageRead", "request_uri": LONG.upper() + "/ID_RSA"},
+    {"category": "StorageRead", "request_uri": None},
+    {"category": "StorageRead", "request_uri": ""},
+    {"category": "StorageRead"},
+    {},
+]
+
+@pytest.fixture(params=["automaton", "substring"])
+def matcher_mode(request, monkeypatch):
+    if request.param == "automaton":
+        pytest.importorskip("ahocorasick")
+    else:
+        monkeypatch.setattr(P, "ahocorasick", None)
+
+@pytest.mark.parametrize("ev", EVENTS)
+def test_rule_matcher_matches_baseline(matcher_mode, ev):
+    expected = [r.get("name") for r in RULES if baseline_event_matches(r, ev)]
+    assert P.RuleMatcher(RULES).match(ev) == expected
+
+def test_rule_matcher_edge_cases():
+    ev = {"request_uri": "/backup/id_rsa"}
+    fired = P.RuleMatcher(RULES).match(ev)
+    assert "empty-any" not in fired
+    assert "empty-all" in fired
+    assert "blank-any" in fired
+    assert "blank-all" in fired
+    assert "missing-field" not in fired
+    assert "missing-field-all" in fired
+
+def test_rule_matcher_accepts_non_string_indicators():
+    # YAML parses `any: [403]` as an int
+    rules = [{"name": "forbidden", "when": {"contains": {"field": "status_code", "any": [403]}}}]
+    assert P.RuleMatcher(rules).match({"status_code": "403"}) == ["forbidden"]
+    assert P.RuleMatcher(rules).match({"status_code": "200"}) == []
+
+@pytest.mark.parametrize("rule", ["not-a-dict", {"when": {"contains": "uri"}}, {"when": {"contains": {"field": "f", "any": 5}}}])
+def test_rule_matcher_rejects_malformed_rules(rule):
+    with pytest.raises(ValueError):
+        P.RuleMatcher([rule])
+
+
+class FakeReader:
+    """Stands in for LogBlobReader: {(container, blob_name): bytes}, served in small chunks."""
+
+    def __init__(self, blobs, chunk_size=7):
+        self.blobs = blobs
+        self.chunk_size = chunk_size
+
+    async def iter_blobs(self):
+        for c, name in self.blobs:
+            yield {"container": c, "blob_name": name, "etag": "e"}
+
+    async def download_blob(self, c, name):
+        data = self.blobs[(c, name)]
+        for i in range(0, len(data), self.chunk_size):
+            yield data[i:i + self.chunk_size]
+
+def make_store(tmp_path):
+    return P.EventStore(str(tmp_path / "azlure.db"))
+
+def test_automaton_built_once_per_config(tmp_path, monkeypatch):
+    ahocorasick = pytest.importorskip("ahocorasick")
+    builds = []
+
+    def counting_automaton():
+        builds.append(1)
+        return ahocorasick.Automaton()
+
+    monkeypatch.setattr(P, "ahocorasick", types.SimpleNamespace(Automaton=counting_automaton))
+    rules = P.RuleMatcher([{"name": "r", "when": {"contains": {"field": "request_uri", "any": ["id_rsa"]}}}])
+    assert len(builds) == 1
+
+    store = make_store(tmp_path)
+    dispatcher = P.AlertDispatcher({"stdout": False})
+    for n in range(3):
+        reader = FakeReader({("insights-logs-storageread", f"b{n}.json"): b'{"uri": "/backup/' + LONG.encode() + b'/id_rsa"}\n'})
+        asyncio.run(P.run_once(rules, reader, store, dispatcher))
+    assert len(builds) == 1
+    assert store.conn.execute("SELECT COUNT(*) FROM alerts").fetchone()[0] == 3
+
+def test_store_failure_is_per_blob(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    real_add = store.add_events_bulk
+
+    def add_events_bulk(c, name, evs):
+        if name == "bad.json":
+            raise P.sqlite3.OperationalError("database is locked")
+        return real_add(c, name, evs)
+
+    monkeypatch.setattr(store, "add_events_bulk", add_events_bulk)
+    blobs = {("insights-logs-storageread", n): b'{"a": 1}\n{"b": 2}\n' for n in ("a.json", "bad.json", "c.json")}
+    asyncio.run(P.run_once(P.RuleMatcher([]), FakeReader(blobs), store, P.AlertDispatcher({"stdout": False})))
+    assert store.processed_blob_keys() == {("insights-logs-storageread", "a.json"), ("insights-logs-storageread", "c.json")}
+    assert store.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 4
+
+NDJSON_5 = b"".join(b'{"uri": "/backup/%d%s"}\n' % (i, b"/id_rsa" if i % 2 else b"") for i in range(5))
+ID_RSA_RULE = [{"name": "id_rsa", "when": {"contains": {"field": "request_uri", "any": ["id_rsa"]}}}]
+
+def test_events_written_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(P, "EVENT_BATCH_SIZE", 2)
+    store = make_store(tmp_path)
+    reader = FakeReader({("insights-logs-storageread", "b.json"): NDJSON_5})
+    asyncio.run(P.run_once(P.RuleMatcher(ID_RSA_RULE), reader, store, P.AlertDispatcher({"stdout": False})))
+    uris = store.conn.execute("SELECT request_uri FROM events ORDER BY id").fetchall()
+    assert [u for (u,) in uris] == ["/backup/%d%s" % (i, "/id_rsa" if i % 2 else "") for i in range(5)]
+    alerted = store.conn.execute(
+        "SELECT e.request_uri FROM alerts a JOIN events e ON e.id = a.event_id ORDER BY a.id").fetchall()
+    assert [u for (u,) in alerted] == ["/backup/1/id_rsa", "/backup/3/id_rsa"]
+    assert store.processed_blob_keys() == {("insights-logs-storageread", "b.json")}
+
+def test_failed_download_discards_written_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(P, "EVENT_BATCH_SIZE", 2)
+
+    class FailingReader(FakeReader):
+        async def download_blob(self, c, name):
+            async for chunk in super().download_blob(c, name):
+                yield chunk
+            raise P.AzureError("connection reset")
+
+    store = make_store(tmp_path)
+    reader = FailingReader({("insights-logs-storageread", "b.json"): NDJSON_5})
+    asyncio.run(P.run_once(P.RuleMatcher(ID_RSA_RULE), reader, store, P.AlertDispatcher({"stdout": False})))
+    assert store.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 0
+    assert store.conn.execute("SELECT COUNT(*) FROM alerts").fetchone()[0] == 0
+    assert store.processed_blob_keys() == set()
+
+def test_bulk_alert_ids_point_at_their_events(tmp_path):
+    store = make_store(tmp_path)
+    c = "insights-logs-storageread"
+    with store.transaction():
+        old = store.add_events_bulk(c, "old.json", [{"request_uri": f"/old/{i}"} for i in range(3)])
+    store.discard_events([(old[-1], old[-1])])  # a deleted tail row must not shift later ids
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.add_events_bulk(c, "rolled-back.json", [{"request_uri": "/gone"}] * 4)
+            raise RuntimeError
+    evs = [{"request_uri": f"/new/{i}"} for i in range(5)]
+    with store.transaction():
+        ids = store.add_events_bulk(c, "new.json", evs)
+        store.add_alerts_bulk([(f"rule-{i}", ids[i]) for i in (0, 2, 4)])
+    rows = store.conn.execute(
+        "SELECT a.rule_name, e.request_uri, e.blob_name FROM alerts a JOIN events e ON e.id = a.event_id ORDER BY a.id"
+    ).fetchall()
+    assert rows == [(f"rule-{i}", f"/new/{i}", "new.json") for i in (0, 2, 4)]
+    assert store.conn.execute("SELECT COUNT(*) FROM events WHERE request_uri = '/gone'").fetchone()[0] == 0
+
+@pytest.mark.parametrize("uri, expected", [
+    (None, None),
+    ("", ""),
+    ("https://acct.blob.core.windows.net/c/b", "https://acct.blob.core.windows.net/c/b"),
+    ("https://a/c/b?sv=2022-11-02&sp=r&se=2026-01-01T00:00:00Z&sig=abc%2Bdef%3D",
+     "https://a/c/b?sv=REDACTED&sp=REDACTED&se=REDACTED&sig=REDACTED"),
+    ("https://a/c/b?comp=list&sig=abc&restype=container", "https://a/c/b?comp=list&sig=REDACTED&restype=container"),
+    ("https://a/c/b?sig=abc#frag", "https://a/c/b?sig=REDACTED#frag"),
+    ("https://a/c/sig=abc/b?skoid=x&sktid=y", "https://a/c/sig=abc/b?skoid=REDACTED&sktid=REDACTED"),
+    ("https://a/c/b?xsig=abc", "https://a/c/b?xsig=abc"),
+])
+def test_redact_sas(uri, expected):
+    assert P.redact_sas(uri) == expected